@@ -1,12 +1,373 @@
+import os
 import re
 import logging
 import json
-from typing import List, Dict, Any
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from dataclasses import dataclass
+from typing import List, Dict, Any, Generator, Iterator, Optional, Tuple
 from langchain_ollama import ChatOllama
 from langchain_core.tools import BaseTool
 
 # 外部ツールと関数のインポート (agent_tools.pyに定義されていることが前提)
-from agent_tools import calculate, google_search
+from agent_tools import SearchError, calculate, google_search, search_google
+
+# 検索結果のディスクキャッシュ (任意依存。未インストールの場合はキャッシュせずに毎回検索する)
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+# --------------------------------------------------------------------------
+# --- 正規表現パターン (モジュール読み込み時に一度だけコンパイル) ---
+# --------------------------------------------------------------------------
+
+# 数値・レートの抽出
+_RE_RATE_DECIMAL = re.compile(r'[\d]+\.[\d]+')
+_RE_RATE_NO_DECIMAL = re.compile(r'[\d]{2,3}')
+
+# 計算式の検証
+_RE_SYMBOL_CALC_CHARS = re.compile(r'[\d\s\+\-\*/\(\)\.]+')
+
+# 知識・事実クエリのパターン (末尾アンカーを含むため、ルーターとは別に判定する)
+_RE_FACT_PATTERN = re.compile(r'([\u4e00-\u9fa0\u3040-\u309f\u30a0-\u30ff]+は|\w+とは|何(です)?か$|の名前)')
+
+# 計算式の生成 (四則演算キーワード)
+# 演算ごとの名前付きグループの選択パターンにまとめ、1回の走査で全演算の候補を判定する
+_OP_RE = re.compile(
+    r'(?P<div>分|割|一人あたり|divide)'
+    r'|(?P<mul>入った箱が|ずつ|倍|入っている時|times|multiply)'
+    r'|(?P<add>合わせる|合わせて|足す|合計|plus|added)'
+    r'|(?P<sub>引く|残る|除く|minus|subtracted)'
+)
+# 演算ごとの計算式テンプレート (定義順が適用の優先順位: Div > Mul > Add > Sub)
+_OP_TEMPLATES = {
+    "div": "{0} / {1}",
+    "mul": "{0} * {1}",
+    "add": "{0} + {1}",
+    "sub": "{0} - {1}",
+}
+
+# LLM応答の後処理
+_RE_INFERENCE_IN_ANSWER = re.compile(r'(足すと|合計|差し引き|したがって|結果は|なります)')
+_RE_DIRECT_CALCULATE = re.compile(r'\(calculate:\s*{.*}\)')
+# 直接回答に埋め込まれた計算式の記法の開始部分 (ストリーミング中は、これ以降のチャンクを保留する)
+_DIRECT_CALCULATE_MARKER = "(calculate:"
+_RE_DIRECT_EXPRESSION = re.compile(r'"expression":\s*"(.*?)"')
+_RE_HALLU_PAREN = re.compile(r'[（(]Kishida Fumio[）)]')
+
+# --------------------------------------------------------------------------
+# --- 計算式のサニタイズ (正規表現を使わない文字単位の処理) ---
+# --------------------------------------------------------------------------
+
+# 四則演算の演算子
+_CALC_OPERATORS = frozenset('+-*/')
+
+class _CalcCharTable(dict):
+    """str.translate 用の変換テーブル。計算式に使える文字 (数字・空白・演算子・括弧・小数点) 以外を削除する。
+
+    未登録の文字は初回参照時に判定してテーブルに登録するため、
+    以降の同じ文字はC実装の辞書参照のみで処理される。
+    """
+    def __missing__(self, code_point: int):
+        char = chr(code_point)
+        # 数字・空白の判定は正規表現の \d, \s と同じくUnicode文字を対象とする
+        keep = char.isdecimal() or char.isspace() or char in _CALC_OPERATORS or char in "()."
+        value = code_point if keep else None
+        self[code_point] = value
+        return value
+
+_CALC_CHAR_TABLE = _CalcCharTable()
+
+# --------------------------------------------------------------------------
+# --- クエリ分類 (ルーティング用) ---
+# --------------------------------------------------------------------------
+
+# 計算キーワード
+MATH_KEYWORDS = ("合計", "合わせて", "全部で", "いくつですか", "引く", "残る", "分ける", "一人あたり", "ずつ", "割って", "足すと",
+                 "何個", "何人", "何倍", "何割", "除く", "カゴ", "plus", "times", "multiply", "divide", "minus", "added", "subtracted")
+# 最新情報を問うクリティカルキーワード (ハルシネーション対策の対象)
+CRITICAL_SEARCH_KEYWORDS = ("総理大臣", "大統領", "首相", "最新", "現在", "いつ", "誰", "どこ", "prime minister", "president", "current", "latest")
+# 通貨換算キーワード (円とドルの両方を含む場合に通貨換算クエリとみなす)
+CURRENCY_JPY_KEYWORDS = ("円", "Yen")
+CURRENCY_USD_KEYWORDS = ("ドル", "Dollar", "USD")
+# 動画/YouTube関連キーワード
+YOUTUBE_KEYWORDS = ("動画", "YouTube", "ユーチューブ", "ビデオ", "Vlog", "video")
+
+def _alternation(keywords) -> str:
+    """キーワード群を正規表現の選択パターン文字列に変換する。
+
+    照合対象は小文字化済みのクエリのため、キーワードも小文字に揃える。
+    """
+    return '|'.join(re.escape(keyword.lower()) for keyword in keywords)
+
+# 全カテゴリを名前付きグループの選択パターンにまとめ、入力文字列を1回の走査で分類する
+# 入力は小文字化済みのクエリを前提とし、re.IGNORECASE (文字ごとの大文字小文字の畳み込み) は使用しない
+# - usd_amount: ドル金額 (例: 100ドル)。後続の「ドル」は先読みのみで消費せず、usd として別途検出する。
+# - rate_q: レートのみを問う定型句。「円」「1」「dollar」は消費せず、jpy / num / usd として別途検出する。
+_ROUTER_RE = re.compile(
+    r'(?P<rate_q>何(?=円ですか)|how much is (?=1 dollar))'
+    f'|(?P<math>{_alternation(MATH_KEYWORDS)})'
+    f'|(?P<critical>{_alternation(CRITICAL_SEARCH_KEYWORDS)})'
+    f'|(?P<jpy>{_alternation(CURRENCY_JPY_KEYWORDS)})'
+    f'|(?P<usd>{_alternation(CURRENCY_USD_KEYWORDS)})'
+    f'|(?P<youtube>{_alternation(YOUTUBE_KEYWORDS)})'
+    r'|(?P<usd_amount>\d+)(?=\s*(?:ドル|usd))'
+    r'|(?P<num>\d+)'
+    r'|(?P<ops>[\+\-\*/])'
+)
+
+@dataclass(frozen=True)
+class QueryFeatures:
+    """入力メッセージの分類結果。run() で一度だけ算出し、各ガードレールとヘルパーで共有する。"""
+    text: str = ""                     # 正規化済み (前後の空白除去・小文字化) のクエリ
+    numbers: Tuple[str, ...] = ()      # 出現順の全数値
+    usd_amounts: Tuple[str, ...] = ()  # 「ドル」「USD」が直後に続く数値
+    has_math_kw: bool = False
+    has_critical: bool = False
+    has_currency_jpy: bool = False
+    has_currency_usd: bool = False
+    has_youtube: bool = False
+    is_symbol_calc: bool = False       # 演算子 (+ - * /) を含む
+    has_rate_only_phrase: bool = False # 「何円ですか」「how much is 1 dollar」を含む
+
+    @property
+    def is_currency_query(self) -> bool:
+        """円とドルの両方を含む通貨換算クエリかどうか。"""
+        return self.has_currency_jpy and self.has_currency_usd
+
+def _extract_query_features(text: str) -> QueryFeatures:
+    """クエリを _ROUTER_RE で1回走査し、ルーティングに必要な特徴量を抽出する。
+
+    Args:
+        text (str): 分類するクエリ文字列。_normalize_query() と同様に正規化済みであること。
+
+    Returns:
+        QueryFeatures: クエリの分類結果。
+    """
+    numbers = []
+    usd_amounts = []
+    groups = set()
+    for match in _ROUTER_RE.finditer(text):
+        group = match.lastgroup
+        if group == "num":
+            numbers.append(match.group())
+        elif group == "usd_amount":
+            numbers.append(match.group())
+            usd_amounts.append(match.group())
+        else:
+            groups.add(group)
+    
+    return QueryFeatures(
+        text=text,
+        numbers=tuple(numbers),
+        usd_amounts=tuple(usd_amounts),
+        has_math_kw="math" in groups,
+        has_critical="critical" in groups,
+        has_currency_jpy="jpy" in groups,
+        has_currency_usd="usd" in groups,
+        has_youtube="youtube" in groups,
+        is_symbol_calc="ops" in groups,
+        has_rate_only_phrase="rate_q" in groups,
+    )
+
+# --------------------------------------------------------------------------
+# --- システムプロンプト ---
+# --------------------------------------------------------------------------
+# 固定のガードレール文のみで構成し、可変部分 (質問・検索結果) は常にhumanメッセージとして末尾に付加する。
+# プロンプトの先頭をバイト単位で同一に保つことで、Ollamaのプロンプトキャッシュが効く。
+
+# 通貨換算用: 検索結果から為替レートを抽出する
+_SYS_SUMMARY = (
+    "あなたは提供された質問と検索結果から、**最新の為替レートの数値**を抽出する専門家です。"
+    "質問に計算要素が含まれている場合でも、まずは**現在の1ドルあたりのレート（小数点を含む）のみ**を簡潔な日本語の文章（例: 1ドルは155.73円です。）で出力してください。"
+    "**回答は必ず日本語で行ってください。**"
+)
+
+# RAG最終回答生成用: 検索結果のみに基づく回答を強制する
+_SYS_RAG_ANSWER = (
+    "あなたは、提供された検索結果（スニペット）に基づき、ユーザーの質問に簡潔かつ直接的に回答する専門家です。"
+    "**【最厳守事項 - 必須】**"
+    "1. **回答は、提供された検索結果（スニペット）に書かれている情報のみで構成してください。あなたの内部知識や推論を絶対に追加してはいけません。**"
+    "2. 質問が**人物名や役職**（例: 総理大臣）を尋ねている場合、検索結果内で見つかった**人物のフルネーム（漢字）**と**役職**を**そのまま引用**して回答を生成してください。"
+    "3. 検索結果に含まれていない**古い情報**や**合成された情報**を**回答に混ぜてはいけません**。検索結果が示す最新の情報のみを使ってください。"
+    "4. 質問が英語であっても、**回答は必ず自然な日本語の文章**として開始・終了してください。**"
+    "5. **計算要素**は無視し、検索結果に記載されている**事実のみ**を述べてください。計算や推論は厳禁です。"
+    "6. ツールの利用に関するメタなコメントは厳禁です。"
+)
+
+# トップLLM (ツール推奨ルーター) 用
+_SYS_ROUTER = (
+    "あなたは外部ツールを利用して質問に答えるAIエージェントです。"
+    "**【最重要ルール】**"
+    "I. 質問が**一般的な概念や定義**であれば、**ツールを使用せずに**、あなたの内部知識で直接、簡潔に回答してください。"
+    "II. **事実や最新情報、動画の検索**が必要な場合のみ、**google_search ツール**を推奨してください。"
+    "III. **計算クエリは、全てガードレールで処理されます。LLMは計算ツールを推奨したり、計算を直接実行したりしないでください。**"
+    "IV. **回答は必ず自然な日本語**で行い、**ツールの利用に関するメタなコメント（例: google_search ツールを使用できます）を絶対に含めないでください。**"
+)
+
+# 小型LLM (直接回答専用) 用
+_SYS_SMALL_DIRECT = (
+    "あなたはユーザーの短い質問に答えるアシスタントです。"
+    "あなたの内部知識で直接、簡潔に回答してください。"
+    "**回答は必ず自然な日本語**で行い、ツールの利用に関するメタなコメントを含めないでください。"
+)
+
+# 小型LLMに回答させるクエリの最大文字数 (これ未満の短い雑談・定義クエリが対象)
+SMALL_MODEL_MAX_QUERY_LENGTH = 40
+
+# Ollamaがモデルをメモリに保持する時間 (呼び出し間でのモデル再ロードを防ぐ)
+OLLAMA_KEEP_ALIVE = "30m"
+
+# 検索とLLMのウォームアップなど、I/O待ちの処理を並行実行するためのスレッドプール
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent-io")
+
+# --------------------------------------------------------------------------
+# --- 計算結果キャッシュ ---
+# --------------------------------------------------------------------------
+
+@lru_cache(maxsize=1024)
+def _cached_calculate(expression: str) -> str:
+    """calculateツールの呼び出し結果をメモ化する (計算式 -> 結果は決定的なため)。"""
+    return calculate.invoke({"expression": expression})
+
+def _calculate(expression: str) -> str:
+    """calculateツールを呼び出す。前後の空白のみが異なる計算式は同一のキャッシュエントリを共有する。"""
+    return _cached_calculate(expression.strip())
+
+# --------------------------------------------------------------------------
+# --- 応答キャッシュ ---
+# --------------------------------------------------------------------------
+
+# 応答キャッシュに保持する最大件数 (超過分は最も古く参照されたものから破棄)
+RESPONSE_CACHE_SIZE = 256
+# 検索結果に基づく回答 (RAG) の有効期限 (秒)。計算などそれ以外の回答は期限なしで保持する
+RESPONSE_CACHE_TTL_RAG = 600
+
+class _ErrorAnswer(str):
+    """エラーを通知する回答。一時的な障害の可能性があるため、応答キャッシュに登録しない。"""
+
+class _SearchAnswer(str):
+    """検索結果に基づく回答 (RAG)。情報が古くなるため、応答キャッシュでは RESPONSE_CACHE_TTL_RAG 秒で失効させる。"""
+
+def _normalize_query(text: str) -> str:
+    """キャッシュのキーとして使用するため、クエリを正規化する。"""
+    return text.strip().lower()
+
+# --------------------------------------------------------------------------
+# --- 検索結果キャッシュ (ディスク, TTL付き) ---
+# --------------------------------------------------------------------------
+
+# キャッシュの保存先ディレクトリ
+SEARCH_CACHE_DIR = os.environ.get("AGENT_SEARCH_CACHE_DIR", ".search_cache")
+# 一般的な知識クエリの有効期限 (秒)
+SEARCH_CACHE_TTL = 3600
+# クリティカルキーワード (最新, 現在など) を含むクエリの有効期限 (秒)
+SEARCH_CACHE_TTL_CRITICAL = 300
+
+@lru_cache(maxsize=1)
+def _search_cache():
+    """検索結果のディスクキャッシュを初回使用時に開く。diskcache未導入または開けない場合はNoneを返す。"""
+    if diskcache is None:
+        return None
+    try:
+        return diskcache.Cache(SEARCH_CACHE_DIR)
+    except Exception as e:
+        # 保存先に書き込めない場合などは、ディスクキャッシュを使用せずに検索する
+        logging.warning("検索キャッシュ (%s) を開けませんでした。キャッシュせずに検索します: %s", SEARCH_CACHE_DIR, e)
+        return None
+
+def _cached_google_search(tool_args: Dict[str, Any], features: Optional[QueryFeatures] = None) -> str:
+    """google_searchツールの本体を呼び出す。結果はクエリに応じたTTLでディスクにキャッシュする。
+
+    為替レートは日中も変動するため、通貨換算クエリはキャッシュせずに毎回検索する。
+    ディスクキャッシュを使用する場合や鮮度が重要なクエリでは、agent_tools のインメモリキャッシュを経由しない
+    (経由すると、その有効期限の分だけ結果が古くなるため)。
+
+    Args:
+        tool_args (Dict[str, Any]): google_searchツールに渡す引数 ({"query": ...})。
+        features (Optional[QueryFeatures]): 呼び出し元で抽出済みのクエリの特徴量。
+            検索クエリと一致しない場合 (LLMが生成したクエリなど) やNoneの場合は抽出し直す。
+
+    Returns:
+        str: 検索結果の文字列。
+
+    Raises:
+        SearchError: 検索に失敗した場合 (失敗した結果はキャッシュしない)。
+    """
+    query = str(tool_args.get("query", ""))
+    normalized_query = _normalize_query(query)
+    if features is None or features.text != normalized_query:
+        features = _extract_query_features(normalized_query)
+    disk_cache = _search_cache()
+    # 通貨換算クエリはディスクキャッシュを使用しない
+    cache = None if features.is_currency_query else disk_cache
+    
+    cache_key = features.text
+    if cache is not None:
+        try:
+            search_result = cache.get(cache_key)
+        except Exception as e:
+            # SQLiteのロック待ちのタイムアウトなど、キャッシュの障害では検索を止めない
+            logging.warning("検索キャッシュの読み込みに失敗しました。キャッシュせずに検索します: %s", e)
+            search_result = None
+        if search_result is not None:
+            logging.info("--- [LOG: Search Cache Hit] ---")
+            return search_result
+    
+    # ディスクキャッシュが無い場合のみ、鮮度が重要でないクエリにインメモリキャッシュを使用する
+    use_memory_cache = disk_cache is None and not (features.is_currency_query or features.has_critical)
+    search_result = search_google(query, use_cache=use_memory_cache)
+    
+    if cache is not None:
+        ttl = SEARCH_CACHE_TTL_CRITICAL if features.has_critical else SEARCH_CACHE_TTL
+        try:
+            cache.set(cache_key, search_result, expire=ttl)
+        except Exception as e:
+            logging.warning("検索キャッシュへの書き込みに失敗しました: %s", e)
+    return search_result
+
+# --------------------------------------------------------------------------
+# --- RAG回答の後処理 ---
+# --------------------------------------------------------------------------
+
+def _clean_hallucination(final_answer: str) -> str:
+    """総理大臣クエリの結果がハルシネーションパターンに合致する場合、括弧内の不正なローマ字表記を削除する。
+
+    検出と削除はコンパイル済みパターンの1回の置換 (subn) で行う。
+
+    Args:
+        final_answer (str): RAGで生成された回答。
+
+    Returns:
+        str: クリーンアップ後の回答。パターンに合致しない場合は元の回答。
+    """
+    if "高市 早苗" not in final_answer:
+        return final_answer
+    
+    # 不正な括弧内のローマ字を削除し、LLMによる合成を隠蔽する
+    cleaned_answer, replaced = _RE_HALLU_PAREN.subn("", final_answer)
+    if not replaced:
+        return final_answer
+    
+    logging.warning("--- [WARNING: RAG Output Failed - Post-Processing Halucination Clean-up Applied] ---")
+    return cleaned_answer.strip()
+
+# --------------------------------------------------------------------------
+# --- ストリーミング出力 ---
+# --------------------------------------------------------------------------
+
+def _partial_marker_length(text: str) -> int:
+    """text の末尾が _DIRECT_CALCULATE_MARKER の先頭部分と一致する文字数を返す。
+
+    チャンクの境界で記法が途中まで届いている場合に、その部分を返さずに保留するために使用する。
+    """
+    for length in range(min(len(_DIRECT_CALCULATE_MARKER) - 1, len(text)), 0, -1):
+        if text.endswith(_DIRECT_CALCULATE_MARKER[:length]):
+            return length
+    return 0
 
 # --------------------------------------------------------------------------
 # --- AdaptiveAgent クラス定義 ---
@@ -18,101 +379,186 @@ class AdaptiveAgent:
     計算クエリはすべてcalculateツールに強制ルーティングし、LLMの不安定な計算能力を排除する。
     また、知識クエリや重要事項を問うクエリに対してはGoogle Searchを強制的に利用するガードレールを持ち、ハルシネーションを防ぐ。
     """
-    def __init__(self, model_name: str = "mistral:instruct", temperature: float = 0.3):
+    # 属性を固定し、インスタンスごとの __dict__ を持たない (属性参照を高速化し、メモリを削減する)
+    __slots__ = ("tools", "model_name", "small_model_name", "temperature", "_response_cache",
+                 "_llm", "_llm_with_tools", "_llm_zero_temp", "_llm_small")
+
+    def __init__(self, model_name: str = "mistral:instruct", temperature: float = 0.3,
+                 small_model_name: Optional[str] = None):
         """AdaptiveAgentの初期化。
 
         Args:
             model_name (str): 使用するOllamaモデル名 (デフォルト: mistral:instruct)
             temperature (float): LLMの応答の多様性 (デフォルト: 0.3)
+            small_model_name (Optional[str]): 短い直接回答クエリに使用する小型Ollamaモデル名
+                (例: qwen2.5:1.5b-instruct-q4_K_M)。Noneの場合は常にトップLLMを使用する。
         """
         
         # 使用可能なツール群
         self.tools: List[BaseTool] = [calculate, google_search]
         
-        # LLMの定義
-        self.llm = ChatOllama(model=model_name, temperature=temperature)
-        self.llm_with_tools = self.llm.bind_tools(self.tools)
-        self.llm_for_summary = ChatOllama(model=model_name, temperature=0.0)
-        self.llm_for_answer = ChatOllama(model=model_name, temperature=0.0)
+        # LLMの設定 (インスタンスは初回アクセス時に生成する)
+        self.model_name = model_name
+        self.small_model_name = small_model_name
+        self.temperature = temperature
+        self._llm: Optional[ChatOllama] = None
+        self._llm_with_tools = None
+        self._llm_zero_temp: Optional[ChatOllama] = None
+        self._llm_small: Optional[ChatOllama] = None
+        
+        # 正規化済みクエリ -> (最終回答, 失効時刻 (期限なしの場合はNone)) のLRUキャッシュ
+        self._response_cache: "OrderedDict[str, Tuple[str, Optional[float]]]" = OrderedDict()
         
-        logging.info(f"Agent Initialized with Model: {model_name}")
+        logging.info("Agent Initialized with Model: %s", model_name)
+
+    # --- LLMの遅延初期化 ---
+    # ガードレールのみで処理が完結するクエリ (計算など) ではLLMを使用しないため、初回アクセス時に生成する。
+    # keep_aliveでモデルをOllama上に常駐させ、プロンプトのプレフィックスキャッシュを再利用する。
+    # cached_property は __dict__ を必要とするため、生成済みインスタンスは __slots__ の属性に保持する。
+
+    @property
+    def llm(self) -> ChatOllama:
+        """トップLLM (指定されたtemperatureを使用)。"""
+        if self._llm is None:
+            self._llm = ChatOllama(model=self.model_name, temperature=self.temperature, keep_alive=OLLAMA_KEEP_ALIVE)
+        return self._llm
+
+    @property
+    def llm_with_tools(self):
+        """ツール (calculate, google_search) をバインドしたトップLLM。"""
+        if self._llm_with_tools is None:
+            self._llm_with_tools = self.llm.bind_tools(self.tools)
+        return self._llm_with_tools
+
+    @property
+    def llm_zero_temp(self) -> ChatOllama:
+        """RAGの要約・回答生成用のLLM (temperature=0.0)。両者は同一設定のため1つのインスタンスを共有する。"""
+        if self._llm_zero_temp is None:
+            self._llm_zero_temp = ChatOllama(model=self.model_name, temperature=0.0, keep_alive=OLLAMA_KEEP_ALIVE)
+        return self._llm_zero_temp
+
+    @property
+    def llm_small(self) -> ChatOllama:
+        """短い直接回答クエリ用の小型LLM (ツールはバインドしない)。"""
+        if self._llm_small is None:
+            self._llm_small = ChatOllama(model=self.small_model_name, temperature=self.temperature, keep_alive=OLLAMA_KEEP_ALIVE)
+        return self._llm_small
 
     # --- ヘルパー関数 (RAG/計算用) ---
 
+    def _warm_up_llm(self, system_prompt: str) -> None:
+        """Ollamaにモデルのロードとシステムプロンプトの評価を先行させる。
+
+        1トークンだけ生成させることで、直後の本呼び出しではプロンプトキャッシュ済みの
+        プレフィックスが再利用される。失敗しても本処理には影響しないため、警告のみ記録する。
+        """
+        try:
+            self.llm_zero_temp.invoke([("system", system_prompt), ("human", "")], options={"num_predict": 1})
+        except Exception as e:
+            logging.warning("LLMのウォームアップに失敗しました: %s", e)
+
     def _summarize_search_result(self, query: str, search_result: str) -> str:
         """Google Searchの結果から計算に必要な情報（特に為替レート）を抽出・要約する。"""
-        logging.info(f"\n--- [LOG: RAG Step 1: Summarize Tool Input] ---")
+        logging.info("\n--- [LOG: RAG Step 1: Summarize Tool Input] ---")
         
         summary_prompt = [
-            ("system", "あなたは提供された質問と検索結果から、**最新の為替レートの数値**を抽出する専門家です。"
-                         "質問に計算要素が含まれている場合でも、まずは**現在の1ドルあたりのレート（小数点を含む）のみ**を簡潔な日本語の文章（例: 1ドルは155.73円です。）で出力してください。"
-                         "**回答は必ず日本語で行ってください。**"),
+            ("system", _SYS_SUMMARY),
             ("human", f"質問: {query}\n検索結果: {search_result}")
         ]
         try:
-            response = self.llm_for_summary.invoke(summary_prompt)
+            response = self.llm_zero_temp.invoke(summary_prompt)
             return response.content.strip()
         except Exception as e:
-            logging.error(f"要約エラー: {e}")
+            logging.error("要約エラー: %s", e)
             return f"要約エラー: {e}"
 
-    def _extract_rate_and_calculate(self, query: str, summary: str) -> str:
-        """通貨換算クエリ専用の堅牢な計算ロジック。"""
+    def _run_calculation(self, expression: str) -> str:
+        """calculateツールで計算式を評価し、カンマ区切りに整形した回答文を返す。
+
+        Args:
+            expression (str): calculateツールに渡す計算式。
+
+        Returns:
+            str: 計算結果と計算式を含む回答文。
+
+        Raises:
+            ValueError: 計算ツールが数値以外 (エラーメッセージ) を返した場合。
+        """
+        calculation_result_str = _calculate(expression)
         
-        logging.info(f"\n--- [LOG: RAG Step 2: Extract & Calculate Tool Input (Rule-based)] ---")
+        # 計算結果をfloatとして安全に処理
+        calculation_result = float(calculation_result_str)
+        logging.info("--- [LOG: Expression: %s, Result: %s] ---", expression, calculation_result)
         
-        # 1. 質問から計算要素（金額）を抽出 (例: 100ドル)
-        amount_match = re.search(r'(\d+)(?=\s*(ドル|USD))', query, re.IGNORECASE)
+        # 計算結果をカンマ区切りで整形
+        if calculation_result == int(calculation_result):
+            result_str = f"{int(calculation_result):,}"
+        else:
+            result_str = f"{calculation_result:,}"
+            
+        return f"計算結果は{result_str}です。（計算式: {expression}）"
+
+    def _extract_rate_and_calculate(self, features: QueryFeatures, summary: str) -> str:
+        """通貨換算クエリ専用の堅牢な計算ロジック。
+
+        Args:
+            features (QueryFeatures): run() で抽出済みの質問の特徴量 (金額の抽出に使用)。
+            summary (str): 検索結果から為替レートを要約した文章。
+
+        Returns:
+            str: 換算結果、またはレートのみの回答。
+        """
+        
+        logging.info("\n--- [LOG: RAG Step 2: Extract & Calculate Tool Input (Rule-based)] ---")
         
-        amount = None
-        if amount_match:
-            amount = amount_match.group(1)
+        # 1. 質問から計算要素（金額）を抽出 (例: 100ドル)
+        if features.usd_amounts:
+            amount = features.usd_amounts[0]
+        elif features.numbers:
+            amount = features.numbers[-1]
         else:
-            all_numbers = re.findall(r'\d+', query)
-            if len(all_numbers) > 0:
-                amount = all_numbers[-1]
-            else:
-                amount = "1" # 数値がない場合は、1ドルと仮定
+            amount = "1" # 数値がない場合は、1ドルと仮定
 
-        logging.info(f"--- [DEBUG: Extracted Amount: {amount}] ---")
+        logging.info("--- [DEBUG: Extracted Amount: %s] ---", amount)
         
         # 2. レートの抽出
-        rate_match = re.search(r'[\d]+\.[\d]+', summary)
+        rate_match = _RE_RATE_DECIMAL.search(summary)
         rate = None
         
         if not rate_match:
-            rate_match_no_decimal = re.search(r'[\d]{2,3}', summary) 
+            rate_match_no_decimal = _RE_RATE_NO_DECIMAL.search(summary) 
             
             if rate_match_no_decimal:
                 rate = rate_match_no_decimal.group(0) 
-                logging.info(f"--- [DEBUG: Extracted Rate (No Decimal Fallback): {rate}] ---")
+                logging.info("--- [DEBUG: Extracted Rate (No Decimal Fallback): %s] ---", rate)
             else:
                 return f"レート情報を検索しましたが、計算に必要なレートを抽出できませんでした。情報: {summary}"
         else:
             rate = rate_match.group(0)
-            logging.info(f"--- [DEBUG: Extracted Rate (Forced Decimal): {rate}] ---")
+            logging.info("--- [DEBUG: Extracted Rate (Forced Decimal): %s] ---", rate)
             
         # 3. レートのみの質問かチェック (英語/日本語対応)
-        is_rate_only_query = re.search(r'(何円ですか|how much is 1 dollar)', query, re.IGNORECASE) is not None and (amount == "1" or amount not in query)
+        is_rate_only_query = features.has_rate_only_phrase and amount == "1"
+        has_multi_digit_usd_amount = any(len(usd_amount) >= 2 for usd_amount in features.usd_amounts)
 
-        if is_rate_only_query and not re.search(r'\d{2,}\s*(ドル|USD)', query, re.IGNORECASE):
+        if is_rate_only_query and not has_multi_digit_usd_amount:
             return f"現在の為替レートは1ドルあたり{rate}円です。"
             
         # 4. 計算式の生成 (レート * 金額)
         clean_expression = f"{rate} * {amount}"
         
         # 5. 計算の実行
-        if re.match(r'[\d\s\+\-\*/\(\)\.]+', clean_expression):
-            logging.info(f"--- [LOG: RAG Step 2: Calling Calculate Tool (Expression: {clean_expression})] ---")
+        if _RE_SYMBOL_CALC_CHARS.match(clean_expression):
+            logging.info("--- [LOG: RAG Step 2: Calling Calculate Tool (Expression: %s)] ---", clean_expression)
             
             try:
                 # calculateツールは文字列として結果を返すと仮定
-                calculation_result_str = calculate.invoke({"expression": clean_expression})
+                calculation_result_str = _calculate(clean_expression)
                 
                 # 計算結果をfloatとして安全に処理
                 calculation_result = float(calculation_result_str)
                 
-                logging.info(f"--- [LOG: RAG Step 2: Calculate Tool Output] ---")
+                logging.info("--- [LOG: RAG Step 2: Calculate Tool Output] ---")
                 
                 # 計算結果を整数または小数第2位まで表示
                 if calculation_result == int(calculation_result):
@@ -123,107 +569,104 @@ class AdaptiveAgent:
 
                 return f"現在のレートで{amount} USドルは{result_str}円です。"
             except ValueError:
-                logging.error(f"通貨計算エラー: 計算結果の型変換に失敗しました: {calculation_result_str}")
+                logging.error("通貨計算エラー: 計算結果の型変換に失敗しました: %s", calculation_result_str)
                 return "為替レートの計算中に予期せぬエラーが発生しました。"
             except Exception as e:
-                logging.error(f"通貨計算エラー: {e}")
+                logging.error("通貨計算エラー: %s", e)
                 return "為替レートの計算中に予期せぬエラーが発生しました。"
         
         return f"計算式を生成できませんでした。情報: {summary}"
     
-    def _generate_expression(self, query: str) -> str:
+    def _generate_expression(self, features: QueryFeatures) -> str:
         """曖昧な自然言語クエリからcalculateツールで使用できる計算式を生成する。
         
         Args:
-            query (str): ユーザーからの自然言語の計算クエリ。
+            features (QueryFeatures): ユーザーからの自然言語の計算クエリの特徴量 (数値の抽出結果を再利用する)。
 
         Returns:
             str: 実行可能な計算式（例: "5 + 3"）、または生成失敗時はNone。
         """
         logging.info("\n--- [LOG: Agent Rule-based Expression Generator Step] ---")
         
-        numbers_in_query = re.findall(r'\d+', query)
-        numbers = numbers_in_query
+        # 計算式に使用するのは先頭の最大3つの数値のみ
+        query = features.text
+        numbers = features.numbers[:3]
         
         if len(numbers) >= 2:
             
             # 【四則演算のルールベース推論のロジック】
-            query_lower = query.lower()
-            
-            is_division_candidate = re.search(r'(分|割|一人あたり|divide)', query_lower) is not None
-            is_multiplication_candidate = re.search(r'(入った箱が|ずつ|倍|入っている時|times|multiply)', query_lower) is not None
-            is_addition_candidate = re.search(r'(合わせる|合わせて|足す|合計|plus|added)', query_lower) is not None
-            is_subtraction_candidate = re.search(r'(引く|残る|除く|minus|subtracted)', query_lower) is not None
+            op_candidates = {match.lastgroup for match in _OP_RE.finditer(query)}
             
-            logging.info(f"--- [DEBUG: Rule Check - Div: {is_division_candidate}, Mul: {is_multiplication_candidate}, Add: {is_addition_candidate}, Sub: {is_subtraction_candidate}] ---")
+            logging.info("--- [DEBUG: Rule Check - Candidates: %s] ---", sorted(op_candidates))
             
             fallback_expression = None
 
             # 複数の演算子が含まれる場合 (例: 150 plus 25 times 4)
-            if is_addition_candidate and is_multiplication_candidate and len(numbers) >= 3:
+            if "add" in op_candidates and "mul" in op_candidates and len(numbers) >= 3:
                 logging.warning("--- [WARNING: Complex Expression (Add/Mul) Detected - Using fixed (N1 + N2 * N3) inference] ---")
                 fallback_expression = f"{numbers[0]} + ({numbers[1]} * {numbers[2]})"
             
             # 複雑なケースでなければ、通常の優先順位で適用 (Div > Mul > Add > Sub)
-            elif is_division_candidate:
-                fallback_expression = f"{numbers[0]} / {numbers[1]}"
-            elif is_multiplication_candidate: 
-                fallback_expression = f"{numbers[0]} * {numbers[1]}"
-            elif is_addition_candidate: 
-                fallback_expression = f"{numbers[0]} + {numbers[1]}"
-            elif is_subtraction_candidate:
-                fallback_expression = f"{numbers[0]} - {numbers[1]}"
+            else:
+                for op_name, template in _OP_TEMPLATES.items():
+                    if op_name in op_candidates:
+                        fallback_expression = template.format(numbers[0], numbers[1])
+                        break
 
             if fallback_expression:
-                logging.info(f"--- [LOG: Rule-based Expression Generated SUCCESS: {fallback_expression}] ---")
+                logging.info("--- [LOG: Rule-based Expression Generated SUCCESS: %s] ---", fallback_expression)
                 return fallback_expression
         
         logging.info("--- [LOG: Rule-based Fallback FAILED (No suitable formula found)] ---")
         return None
     
-    def _process_rag(self, tool_call: Dict[str, Any], query: str) -> str:
+    def _process_rag(self, tool_call: Dict[str, Any], query: str, features: QueryFeatures) -> str:
         """検索ツール(google_search)の結果を処理し、最終回答を生成する。
         
         Args:
             tool_call (Dict[str, Any]): 実行されたツールの情報。
             query (str): ユーザーの元のクエリ。
+            features (QueryFeatures): ユーザーの元のクエリの特徴量。
 
         Returns:
-            str: 検索結果に基づいてLLMが生成した最終回答。
+            str: 検索結果に基づいてLLMが生成した最終回答 (_SearchAnswer)。検索や回答の生成に失敗した場合は _ErrorAnswer。
         """
         
         logging.info("\n--- RAG Process Details (Start) ---")
         
-        # 検索の実行
-        search_result_raw = google_search.invoke(tool_call['arguments'])
-        
         # 通貨換算のチェック（英語/日本語対応）
-        if re.search(r'(円|Yen)', query, re.IGNORECASE) and re.search(r'(ドル|Dollar|USD)', query, re.IGNORECASE):
+        is_currency_query = features.is_currency_query
+        
+        # 検索の実行 (検索の待ち時間中に、後続のLLM呼び出しで使うシステムプロンプトを先行評価させる)
+        search_future = _EXECUTOR.submit(_cached_google_search, tool_call['arguments'], features)
+        warm_up_future = _EXECUTOR.submit(self._warm_up_llm, _SYS_SUMMARY if is_currency_query else _SYS_RAG_ANSWER)
+        try:
+            search_result_raw = search_future.result()
+            search_failed = False
+        except SearchError as e:
+            # 検索の失敗理由をそのまま回答の生成に渡す (この回答はキャッシュしない)
+            search_result_raw = str(e)
+            search_failed = True
+        warm_up_future.result()
+        
+        if is_currency_query:
             summary = self._summarize_search_result(query, search_result_raw)
-            final_answer = self._extract_rate_and_calculate(query, summary)
+            final_answer = self._extract_rate_and_calculate(features, summary)
                     
         else:
             # 💥💥 RAG最終生成プロンプトの厳格化 (ハルシネーション対策) 💥💥
             answer_prompt = [
-                ("system", f"あなたは、提供された検索結果（スニペット）に基づき、ユーザーの質問に簡潔かつ直接的に回答する専門家です。"
-                             f"**【最厳守事項 - 必須】**"
-                             f"1. **回答は、提供された検索結果（スニペット）に書かれている情報のみで構成してください。あなたの内部知識や推論を絶対に追加してはいけません。**"
-                             f"2. 質問が**人物名や役職**（例: 総理大臣）を尋ねている場合、検索結果内で見つかった**人物のフルネーム（漢字）**と**役職**を**そのまま引用**して回答を生成してください。"
-                             f"3. 検索結果に含まれていない**古い情報**や**合成された情報**を**回答に混ぜてはいけません**。検索結果が示す最新の情報のみを使ってください。"
-                             f"4. 質問が英語であっても、**回答は必ず自然な日本語の文章**として開始・終了してください。**"
-                             f"5. **計算要素**は無視し、検索結果に記載されている**事実のみ**を述べてください。計算や推論は厳禁です。"
-                             f"6. ツールの利用に関するメタなコメントは厳禁です。"
-                             ),
+                ("system", _SYS_RAG_ANSWER),
                 ("human", f"質問: {query}\n検索結果: {search_result_raw}")
             ]
             
             try:
                 # LLMによる最終回答の生成
-                response = self.llm_for_answer.invoke(answer_prompt)
+                response = self.llm_zero_temp.invoke(answer_prompt)
                 llm_generated_answer = response.content.strip()
                 
                 # LLMが不必要な計算推論をしないための最終チェック
-                if re.search(r'(足すと|合計|差し引き|したがって|結果は|なります)', llm_generated_answer) and not (re.search(r'(円|Yen)', query, re.IGNORECASE) and re.search(r'(ドル|Dollar|USD)', query, re.IGNORECASE)):
+                if _RE_INFERENCE_IN_ANSWER.search(llm_generated_answer) and not is_currency_query:
                     
                     logging.info("--- [LOG: RAG Answer Rejected - Calculation/Inference Detected. Returning Fixed Rejection Message.] ---")
                     
@@ -232,15 +675,52 @@ class AdaptiveAgent:
                     final_answer = llm_generated_answer
                 
             except Exception as e:
-                final_answer = f"検索結果の処理中にエラーが発生しました: {e}"
+                final_answer = _ErrorAnswer(f"検索結果の処理中にエラーが発生しました: {e}")
 
         logging.info("--- RAG Process Details (End) ---")
+        if search_failed or isinstance(final_answer, _ErrorAnswer):
+            return _ErrorAnswer(final_answer)
+        return _SearchAnswer(final_answer)
+
+    # --- 応答キャッシュ ---
+
+    def _response_cache_key(self, features: QueryFeatures) -> Optional[str]:
+        """応答キャッシュのキーを返す。キャッシュ対象外のクエリの場合はNoneを返す。
+
+        最新情報を問うクリティカルなクエリと通貨換算クエリは、古い回答を返さないようキャッシュしない。
+        """
+        if features.has_critical or features.is_currency_query:
+            return None
+        return features.text
+
+    def _get_cached_response(self, cache_key: Optional[str]) -> Optional[str]:
+        """キャッシュ済みの回答を返す。未登録の場合はNoneを返す。"""
+        if cache_key is None or cache_key not in self._response_cache:
+            return None
+        final_answer, expires_at = self._response_cache[cache_key]
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._response_cache[cache_key]
+            return None
+        logging.info("\n--- [LOG: Response Cache Hit] ---")
+        self._response_cache.move_to_end(cache_key)
         return final_answer
 
+    def _store_response(self, cache_key: Optional[str], final_answer: str) -> None:
+        """回答をキャッシュに登録する。エラー応答 (_ErrorAnswer) はキャッシュせず、RAGの回答には有効期限を設定する。"""
+        if cache_key is None or isinstance(final_answer, _ErrorAnswer):
+            return
+        expires_at = time.monotonic() + RESPONSE_CACHE_TTL_RAG if isinstance(final_answer, _SearchAnswer) else None
+        self._response_cache[cache_key] = (final_answer, expires_at)
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+
+    # --- メイン実行関数 ---
+
     def run(self, current_human_message: str) -> str:
         """エージェントのメイン実行関数。
 
         入力メッセージを解析し、計算、検索、または内部知識に基づく回答にルーティングする。
+        同一クエリ（正規化後）への回答はLRUキャッシュから返す。
 
         Args:
             current_human_message (str): ユーザーからの入力メッセージ。
@@ -248,29 +728,211 @@ class AdaptiveAgent:
         Returns:
             str: エージェントの最終回答。
         """
+        # 前後の空白除去と小文字化は入口で一度だけ行い、以降の処理で共有する
+        msg = current_human_message.strip()
+        features = _extract_query_features(msg.lower())
+        cache_key = self._response_cache_key(features)
         
-        # --- 1. 計算/検索クエリの判定のためのフラグ定義 ---
+        final_answer = self._get_cached_response(cache_key)
+        if final_answer is not None:
+            return final_answer
+        
+        final_answer = self._route_guardrails(msg, features)
+        if final_answer is None and self._is_small_model_query(msg, features):
+            final_answer = self._invoke_small_llm(msg)
+        if final_answer is None:
+            # --- 2. トップLLMへのプロンプト設定と呼び出し (優先度低) ---
+            forced_prompt = [("system", _SYS_ROUTER), ("human", msg)]
+            response = self.llm_with_tools.invoke(forced_prompt)
+            final_answer = self._handle_llm_response(response, msg, features)
+        
+        self._store_response(cache_key, final_answer)
+        return final_answer
+
+    def run_stream(self, current_human_message: str) -> Iterator[str]:
+        """run() のストリーミング版。回答を生成されたチャンク単位で順次返す。
+
+        トップLLMが直接回答する場合のみトークン単位でストリーミングする。ガードレールで処理される
+        クエリ (計算、検索など) は、回答全体の検証・後処理が必要なため、完成した回答を1チャンクで返す。
+
+        Args:
+            current_human_message (str): ユーザーからの入力メッセージ。
+
+        Yields:
+            str: エージェントの回答のチャンク。
+        """
+        # 前後の空白除去と小文字化は入口で一度だけ行い、以降の処理で共有する
+        msg = current_human_message.strip()
+        features = _extract_query_features(msg.lower())
+        cache_key = self._response_cache_key(features)
         
-        # 最新情報を問うクリティカルキーワード (ハルシネーション対策の対象)
-        critical_search_keywords = ["総理大臣", "大統領", "首相", "最新", "現在", "いつ", "誰", "どこ", "prime minister", "president", "current", "latest"]
+        final_answer = self._get_cached_response(cache_key)
+        if final_answer is None:
+            final_answer = self._route_guardrails(msg, features)
+            if final_answer is None and self._is_small_model_query(msg, features):
+                final_answer = yield from self._stream_small_llm_answer(msg)
+                if final_answer is not None:
+                    self._store_response(cache_key, final_answer)
+                    return
+            if final_answer is None:
+                final_answer = yield from self._stream_llm_answer(msg, features)
+                self._store_response(cache_key, final_answer)
+                return
+            self._store_response(cache_key, final_answer)
+        
+        yield final_answer
+
+    # --- 小型LLMによる直接回答 ---
+
+    def _is_small_model_query(self, current_human_message: str, features: QueryFeatures) -> bool:
+        """ガードレールに該当しなかったクエリのうち、小型LLMで直接回答できる短いクエリかどうかを判定する。
+
+        数値・計算・通貨の要素を含むクエリは、トップLLMのツール連携に任せるため対象外とする。
+        """
+        return (
+            self.small_model_name is not None
+            and len(current_human_message) < SMALL_MODEL_MAX_QUERY_LENGTH
+            and not features.numbers
+            and not features.has_math_kw
+            and not features.has_currency_jpy
+            and not features.has_currency_usd
+        )
+
+    def _invoke_small_llm(self, current_human_message: str) -> Optional[str]:
+        """小型LLMで直接回答を生成する。失敗した場合はNoneを返し、トップLLMにフォールバックさせる。"""
+        logging.info("\n--- [LOG: 短い直接回答クエリを検出、小型LLM (%s) にルーティング] ---", self.small_model_name)
+        try:
+            response = self.llm_small.invoke([("system", _SYS_SMALL_DIRECT), ("human", current_human_message)])
+        except Exception as e:
+            logging.warning("小型LLMの呼び出しに失敗しました。トップLLMで処理します: %s", e)
+            return None
+        return response.content.strip() or None
+
+    def _stream_small_llm_answer(self, current_human_message: str) -> Generator[str, None, Optional[str]]:
+        """_invoke_small_llm() のストリーミング版。
+
+        回答を1文字も返す前に失敗した場合はNoneを返し、トップLLMにフォールバックさせる。
+
+        Yields:
+            str: 回答のチャンク。
+
+        Returns:
+            Optional[str]: 最終回答の全文。フォールバックする場合はNone。
+        """
+        logging.info("\n--- [LOG: 短い直接回答クエリを検出、小型LLM (%s) にルーティング] ---", self.small_model_name)
+        prompt = [("system", _SYS_SMALL_DIRECT), ("human", current_human_message)]
+        chunks = []
+        try:
+            for chunk in self.llm_small.stream(prompt):
+                # 先頭の空白のみのチャンクは返さない
+                content = chunk.content if chunks else chunk.content.lstrip()
+                if content:
+                    chunks.append(content)
+                    yield content
+        except Exception as e:
+            if not chunks:
+                logging.warning("小型LLMの呼び出しに失敗しました。トップLLMで処理します: %s", e)
+                return None
+            # 回答の途中で失敗した場合は、返却済みのチャンクに続けてエラーを通知する (エラー応答はキャッシュされない)
+            logging.error("小型LLMの回答生成中にエラーが発生しました: %s", e)
+            error_message = f"\n回答の生成中にエラーが発生しました: {e}"
+            chunks.append(error_message)
+            yield error_message
+            return _ErrorAnswer("".join(chunks).strip())
+        return "".join(chunks).strip() or None
+
+    def _stream_llm_answer(self, current_human_message: str, features: QueryFeatures) -> Generator[str, None, str]:
+        """トップLLMの応答をストリーミングし、最終回答を返す。
+
+        応答がJSON (ツール呼び出し) で始まる可能性がある間はチャンクを保留し、通常の文章と
+        判定できた時点から順次返す。計算式の記法 "(calculate:" が現れた場合や末尾の空白も、
+        最終回答に含まれるか確定するまで保留する。ストリーム終了後は run() と同じ最終回答のうち、
+        未返却の部分のみを返す (ツール呼び出しや計算式の場合は _handle_llm_response の結果)。
+
+        Yields:
+            str: 回答のチャンク。
+
+        Returns:
+            str: 最終回答の全文 (応答キャッシュへの登録用)。
+        """
+        forced_prompt = [("system", _SYS_ROUTER), ("human", current_human_message)]
+        response = None
+        is_passthrough = None # None: 未判定
+        is_held = False       # ツール呼び出しまたは計算式の記法を検出し、以降のチャンクを保留している
+        streamed = 0          # 返却済みの文字数 (先頭の空白を除いた応答本文に対する位置)
+        
+        for chunk in self.llm_with_tools.stream(forced_prompt):
+            response = chunk if response is None else response + chunk
+            text = response.content.lstrip()
+            
+            if is_passthrough is None:
+                if not text:
+                    continue
+                is_passthrough = not text.startswith(('{', '[')) and not response.tool_calls
+            if not is_passthrough or is_held:
+                continue
+            
+            if response.tool_calls or text.find(_DIRECT_CALCULATE_MARKER, streamed) >= 0:
+                # 以降はストリーム終了後に、run() と同じ処理で最終回答を確定させる
+                is_held = True
+                continue
+            
+            ready = text.rstrip()
+            ready_length = len(ready) - _partial_marker_length(ready)
+            if ready_length > streamed:
+                yield text[streamed:ready_length]
+                streamed = ready_length
+        
+        if response is None:
+            return ""
+        
+        response_content = response.content.strip()
+        if is_passthrough and not response.tool_calls and not _RE_DIRECT_CALCULATE.search(response_content):
+            final_answer = response_content
+        else:
+            final_answer = self._handle_llm_response(response, current_human_message, features)
+        
+        streamed_text = response_content[:streamed]
+        if final_answer.startswith(streamed_text):
+            rest = final_answer[streamed:]
+        else:
+            # 計算式の前の文章を返却済みの場合は、計算結果を改行して続ける
+            rest = "\n" + final_answer
+        if rest:
+            yield rest
+        return final_answer
+
+    def _route_guardrails(self, current_human_message: str, features: QueryFeatures) -> Optional[str]:
+        """ルールベースのガードレールでクエリをルーティングし、最終回答を生成する。
+
+        Args:
+            current_human_message (str): ユーザーからの入力メッセージ (前後の空白除去済み)。
+            features (QueryFeatures): 入力メッセージの特徴量。
+
+        Returns:
+            Optional[str]: ガードレールが生成した最終回答。どのガードレールにも該当しない場合はNone。
+        """
+        
+        # --- 1. 計算/検索クエリの判定のためのフラグ定義 ---
         
         # 計算キーワード
-        has_math_keywords = re.search(r'(合計|合わせて|全部で|いくつですか|引く|残る|分ける|一人あたり|ずつ|割って|足すと|何個|何人|何倍|何割|除く|カゴ|plus|times|multiply|divide|minus|added|subtracted)', current_human_message, re.IGNORECASE) is not None
+        has_math_keywords = features.has_math_kw
         
-        has_numbers = re.search(r'\d+', current_human_message) is not None
-        is_symbol_calculation = (re.search(r'[\d\s\+\-\*/\(\)\.]+', current_human_message) is not None and re.search(r'[\+\-\*/]', current_human_message) is not None)
+        has_numbers = bool(features.numbers)
+        is_symbol_calculation = features.is_symbol_calc
+        
+        # クリティカルキーワード・通貨換算の判定 (以降の各ガードレールで再利用する)
+        has_critical = features.has_critical
+        is_currency_query = features.is_currency_query
         
         # 計算クエリ候補の判定
         is_calculation_query_candidate = (has_math_keywords or is_symbol_calculation) and has_numbers
         
         # 計算と検索が混在しているか (通貨換算を除く)
-        is_mixed_query = is_calculation_query_candidate and (any(re.search(kw, current_human_message, re.IGNORECASE) for kw in critical_search_keywords)) and not (re.search(r'(円|Yen)', current_human_message, re.IGNORECASE) and re.search(r'(ドル|Dollar|USD)', current_human_message, re.IGNORECASE))
+        is_mixed_query = is_calculation_query_candidate and has_critical and not is_currency_query
         
         # クリティカルな事実を問うクエリの判定 (計算を含まず、重要キーワードを含む)
-        is_critical_fact_query = (
-            any(re.search(kw, current_human_message, re.IGNORECASE) for kw in critical_search_keywords) and
-            not is_calculation_query_candidate
-        )
+        is_critical_fact_query = has_critical and not is_calculation_query_candidate
 
         # 💥💥【混合クエリの即時拒否 (最優先)】💥💥
         if is_mixed_query:
@@ -281,92 +943,74 @@ class AdaptiveAgent:
         if is_calculation_query_candidate:
             logging.info("\n--- [LOG: 計算クエリ候補を検出、calculate に強制ルーティング] ---")
             
-            expression = current_human_message.strip()
+            expression = current_human_message
             clean_expression = expression
             
             if not is_symbol_calculation:
                 logging.info("--- [LOG: 曖昧な計算を検出。エージェント推論ステップへ (LLM排除)] ---")
-                clean_expression = self._generate_expression(expression)
+                clean_expression = self._generate_expression(features)
                 
-                logging.info(f"--- [LOG: Expression Generator Return: {clean_expression}] ---")
+                logging.info("--- [LOG: Expression Generator Return: %s] ---", clean_expression)
             else:
-                clean_expression = re.sub(r'[^\d\s\+\-\*/\(\)\.]', '', expression).strip()
+                clean_expression = expression.translate(_CALC_CHAR_TABLE).strip()
             
-            
-            if clean_expression and re.match(r'[\d\s\+\-\*/\(\)\.]+', clean_expression) and re.search(r'[\+\-\*/]', clean_expression):
+            # どちらの経路でも計算式は計算用の文字のみで構成されるため、演算子の有無のみを確認する
+            if clean_expression and not _CALC_OPERATORS.isdisjoint(clean_expression):
                 try:
                     logging.info("--- [LOG: Calculate Tool Called (Safe Mode)] ---")
-                    calculation_result_str = calculate.invoke({"expression": clean_expression})
-                    
-                    # 計算結果をfloatとして安全に処理
-                    calculation_result = float(calculation_result_str)
-                    
-                    logging.info(f"\n--- [LOG: Calculate Tool Result (Guardrail) -> Forced Return] ---")
-                    logging.info(f"--- [LOG: Expression (Cleaned): {clean_expression}, Result: {calculation_result}] ---")
+                    final_answer = self._run_calculation(clean_expression)
                     
-                    # 計算結果をカンマ区切りで整形
-                    if calculation_result == int(calculation_result):
-                        result_str = f"{int(calculation_result):,}"
-                    else:
-                        result_str = f"{calculation_result:,}"
-                        
-                    return f"計算結果は{result_str}です。（計算式: {clean_expression}）"
+                    logging.info("\n--- [LOG: Calculate Tool Result (Guardrail) -> Forced Return] ---")
+                    return final_answer
                 except (ValueError, TypeError):
-                    return "計算式は検出できましたが、計算結果の処理中に予期せぬエラーが発生しました。"
+                    return _ErrorAnswer("計算式は検出できましたが、計算結果の処理中に予期せぬエラーが発生しました。")
                 except Exception:
-                    return "計算式は検出されましたが、計算ツールで予期せぬエラーが発生しました。"
+                    return _ErrorAnswer("計算式は検出されましたが、計算ツールで予期せぬエラーが発生しました。")
             else:
                 return "計算意図は検出されましたが、この形式の複雑な計算には現在対応できません。"
 
         # 💥💥【新ガードレール 0.7: 事実クエリの強制検索 (最優先) 】💥💥
         if is_critical_fact_query:
             logging.info("\n--- [LOG: クリティカル検索キーワード検出 (総理大臣, 誰, 最新など) -> 強制検索にルーティング] ---")
-            final_answer = self._process_rag({"name": "google_search", "arguments": {"query": current_human_message}}, current_human_message)
+            final_answer = self._process_rag({"name": "google_search", "arguments": {"query": current_human_message}}, current_human_message, features)
             
             # 💥💥 RAG後の回答クリーンアップガードレール (最終防御線) 💥💥
-            # 総理大臣クエリの結果がハルシネーションパターンに合致する場合、括弧内の不正なローマ字表記を削除する。
-            if "高市 早苗" in final_answer and ("(Kishida Fumio)" in final_answer or "（Kishida Fumio）" in final_answer):
-                logging.warning("--- [WARNING: RAG Output Failed - Post-Processing Halucination Clean-up Applied] ---")
-                
-                # 不正な括弧内のローマ字を削除し、LLMによる合成を隠蔽する
-                final_answer = final_answer.replace("(Kishida Fumio)", "").strip()
-                final_answer = final_answer.replace("（Kishida Fumio）", "").strip()
-
-            return final_answer
+            return _clean_hallucination(final_answer)
             
         # 💥💥【最重要ガードレール 1】通貨換算チェック 💥💥
-        if re.search(r'(円|Yen)', current_human_message, re.IGNORECASE) and re.search(r'(ドル|Dollar|USD)', current_human_message, re.IGNORECASE):
+        if is_currency_query:
             logging.info("\n--- [LOG: 通貨換算クエリを検出、RAG + Calculate にルーティング] ---")
             tool_call = {"name": "google_search", "arguments": {"query": current_human_message}}
-            return self._process_rag(tool_call, current_human_message)
+            return self._process_rag(tool_call, current_human_message, features)
             
         # 💥💥【新ガードレール 1.5】知識・事実クエリの強制検索 💥💥
         # 「日本3名山は？」のように、0.7のキーワードがない汎用的な知識クエリを捕捉
-        is_fact_query_pattern = re.search(r'([\u4e00-\u9fa0\u3040-\u309f\u30a0-\u30ff]+は|\w+とは|何(です)?か$|の名前)', current_human_message) is not None
+        is_fact_query_pattern = _RE_FACT_PATTERN.search(current_human_message) is not None
         
         if is_fact_query_pattern and not is_calculation_query_candidate:
             logging.info("\n--- [LOG: 知識・事実クエリパターンを検出 (日本3名山など)、強制検索にルーティング] ---")
             tool_call = {"name": "google_search", "arguments": {"query": current_human_message}}
-            return self._process_rag(tool_call, current_human_message)
+            return self._process_rag(tool_call, current_human_message, features)
 
         # 💥💥【ガードレール 2】動画/YouTube関連クエリを検出したら、強制的にGoogle Searchにルーティング 💥💥
-        youtube_keywords = ["動画", "YouTube", "ユーチューブ", "ビデオ", "Vlog", "video"]
-        if any(re.search(kw, current_human_message, re.IGNORECASE) for kw in youtube_keywords):
+        if features.has_youtube:
             logging.info("\n--- [LOG: 動画/YouTube関連クエリを検出、Google Search にルーティング] ---")
             tool_call = {"name": "google_search", "arguments": {"query": current_human_message}}
-            return self._process_rag(tool_call, current_human_message)
-
-        # --- 2. トップLLMへのプロンプト設定と呼び出し (優先度低) ---
-        forced_system_prompt = (
-            "あなたは外部ツールを利用して質問に答えるAIエージェントです。"
-            "**【最重要ルール】**"
-            "I. 質問が**一般的な概念や定義**であれば、**ツールを使用せずに**、あなたの内部知識で直接、簡潔に回答してください。"
-            "II. **事実や最新情報、動画の検索**が必要な場合のみ、**google_search ツール**を推奨してください。"
-            "III. **計算クエリは、全てガードレールで処理されます。LLMは計算ツールを推奨したり、計算を直接実行したりしないでください。**"
-            "IV. **回答は必ず自然な日本語**で行い、**ツールの利用に関するメタなコメント（例: google_search ツールを使用できます）を絶対に含めないでください。**"
-        )
-        forced_prompt = [("system", forced_system_prompt), ("human", current_human_message)]
-        response = self.llm_with_tools.invoke(forced_prompt)
+            return self._process_rag(tool_call, current_human_message, features)
+
+        return None
+
+    def _handle_llm_response(self, response: Any, current_human_message: str, features: QueryFeatures) -> str:
+        """トップLLMの応答 (ツール呼び出し、JSON文字列、直接回答) を処理し、最終回答を生成する。
+
+        Args:
+            response (Any): トップLLMの応答メッセージ。
+            current_human_message (str): ユーザーからの入力メッセージ。
+            features (QueryFeatures): 入力メッセージの特徴量。
+
+        Returns:
+            str: エージェントの最終回答。
+        """
         tool_calls = response.tool_calls
         
         # --- 3. 実行ロジックの優先度設定 (ツール実行処理) ---
@@ -380,25 +1024,16 @@ class AdaptiveAgent:
     
                 if tool_name == 'calculate':
                     try:
-                        calculation_result_str = calculate.invoke({"expression": args.get('expression', '0')})
-                        calculation_result = float(calculation_result_str)
-                        
-                        expression_str = args.get('expression', '')
-                        if calculation_result == int(calculation_result):
-                            result_str = f"{int(calculation_result):,}"
-                        else:
-                            result_str = f"{calculation_result:,}"
-                        
-                        final_answer = f"計算結果は{result_str}です。（計算式: {expression_str}）"
+                        final_answer = self._run_calculation(args.get('expression', '0'))
                     except (ValueError, TypeError):
-                        final_answer = "計算式は検出されましたが、計算結果の処理中に予期せぬエラーが発生しました。"
+                        final_answer = _ErrorAnswer("計算式は検出されましたが、計算結果の処理中に予期せぬエラーが発生しました。")
                     except Exception:
-                        final_answer = "計算式は検出されましたが、計算ツールで予期せぬエラーが発生しました。"
+                        final_answer = _ErrorAnswer("計算式は検出されましたが、計算ツールで予期せぬエラーが発生しました。")
                     
                     break
                 
                 elif tool_name == 'google_search':
-                    final_answer = self._process_rag({"name": tool_name, "arguments": args}, current_human_message)
+                    final_answer = self._process_rag({"name": tool_name, "arguments": args}, current_human_message, features)
                     break
 
         if final_answer is not None:
@@ -423,58 +1058,36 @@ class AdaptiveAgent:
                 
                 if tool_name == 'calculate':
                     logging.info("\n--- [LOG: JSON文字列からcalculateを検出] ---")
-                    calculation_result_str = calculate.invoke({"expression": args.get('expression', '0')})
-                    calculation_result = float(calculation_result_str)
-                    
-                    expression_str = args.get('expression', '')
-                    if calculation_result == int(calculation_result):
-                        result_str = f"{int(calculation_result):,}"
-                    else:
-                        result_str = f"{calculation_result:,}"
-
-                    return f"計算結果は{result_str}です。（計算式: {expression_str}）"
+                    return self._run_calculation(args.get('expression', '0'))
 
                 elif tool_name == 'google_search':
                     logging.info("\n--- [LOG: JSON文字列からgoogle_searchを検出] ---")
-                    return self._process_rag({"name": tool_name, "arguments": args}, current_human_message)
+                    return self._process_rag({"name": tool_name, "arguments": args}, current_human_message, features)
             except (json.JSONDecodeError, ValueError) as e:
-                logging.warning(f"JSON解析エラーまたは予期せぬ形式: {e}. 通常の回答として処理します。")
+                logging.warning("JSON解析エラーまたは予期せぬ形式: %s. 通常の回答として処理します。", e)
                 pass
 
         # 💥 優先度 3: 最終フォールバック（強制的に検索）💥
-        if any(re.search(kw, current_human_message, re.IGNORECASE) for kw in critical_search_keywords) and not tool_calls and not response_content:
+        if features.has_critical and not tool_calls and not response_content:
             logging.info("\n--- [LOG: 最終フォールバック (クリティカル知識クエリを検出したがLLMがツール推奨をスキップ -> 強制検索)] ---")
-            final_answer = self._process_rag({"name": "google_search", "arguments": {"query": current_human_message}}, current_human_message)
+            final_answer = self._process_rag({"name": "google_search", "arguments": {"query": current_human_message}}, current_human_message, features)
             
             # 💥💥 RAG後の回答クリーンアップガードレール (最終防御線) 💥💥
-            if "高市 早苗" in final_answer and ("(Kishida Fumio)" in final_answer or "（Kishida Fumio）" in final_answer):
-                logging.warning("--- [WARNING: RAG Output Failed - Post-Processing Halucination Clean-up Applied] ---")
-                final_answer = final_answer.replace("(Kishida Fumio)", "").strip()
-                final_answer = final_answer.replace("（Kishida Fumio）", "").strip()
-
-            return final_answer
+            return _clean_hallucination(final_answer)
             
         # 💥 優先度 4: LLMがToolを使わずに直接回答したと判断 💥
         
-        if re.search(r'\(calculate:\s*{.*}\)', response_content):
+        if _RE_DIRECT_CALCULATE.search(response_content):
             
-            match = re.search(r'"expression":\s*"(.*?)"', response_content)
+            match = _RE_DIRECT_EXPRESSION.search(response_content)
             if match:
                 expression = match.group(1).strip()
-                logging.info(f"\n--- [LOG: 直接回答からcalculate式を検出: {expression}] ---")
+                logging.info("\n--- [LOG: 直接回答からcalculate式を検出: %s] ---", expression)
                 
                 try:
-                    calculation_result_str = calculate.invoke({"expression": expression})
-                    calculation_result = float(calculation_result_str)
-                    
-                    if calculation_result == int(calculation_result):
-                        result_str = f"{int(calculation_result):,}"
-                    else:
-                        result_str = f"{calculation_result:,}"
-                        
-                    return f"計算結果は{result_str}です。（計算式: {expression}）"
+                    return self._run_calculation(expression)
                 except (ValueError, TypeError):
-                    return "計算式は検出されましたが、計算結果の処理中に予期せぬエラーが発生しました。"
+                    return _ErrorAnswer("計算式は検出されましたが、計算結果の処理中に予期せぬエラーが発生しました。")
                 except Exception:
                     pass
         
@@ -38,7 +38,8 @@ def main():
     Ctrl/Cmd+Cが入力されるまで、ユーザーからの入力を受け付け、
     AdaptiveAgentの処理結果を出力する。
     """
-    agent = AdaptiveAgent(model_name="mistral:instruct") 
+    # 環境変数 'AGENT_SMALL_MODEL' にOllamaモデル名を設定すると、短い直接回答クエリをその小型モデルで処理する
+    agent = AdaptiveAgent(model_name="mistral:instruct", small_model_name=os.environ.get("AGENT_SMALL_MODEL") or None)
     
     if not LOG_ENABLED:
         print(f"🔔 Agent Log Output: OFF")
@@ -65,11 +66,17 @@ def main():
             if user_input.lower() in ["exit", "quit"]:
                 break
             
-            answer = agent.run(user_input) 
+            # 回答はストリーミングで受け取り、生成されたチャンクから順に表示する
+            print("\nAgent: ", end="", flush=True)
+            chunks = []
+            for chunk in agent.run_stream(user_input):
+                print(chunk, end="", flush=True)
+                chunks.append(chunk)
+            print()
+            answer = "".join(chunks)
             
             if LOG_ENABLED: logging.info(f"\n--- Agent Final Answer: {answer} ---")
             
-            print("\nAgent:", answer)
             print("---")
             
         except KeyboardInterrupt:
@@ -3,12 +3,34 @@
 安全な計算ロジックと、SerpAPIを利用したGoogle検索機能を提供する。
 """
 import ast
+import asyncio
 import operator
 import os
 import logging
+import random
+import threading
+import time
+from functools import lru_cache
+from itertools import chain, islice
+import requests
+from requests.adapters import HTTPAdapter
 from langchain_core.tools import tool
-from serpapi import GoogleSearch
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:
+    # aiohttpが未インストールの場合、非同期版はgoogle_searchをスレッドで実行する
+    aiohttp = None
+
+try:
+    from cachetools import TTLCache
+except ImportError:
+    # cachetoolsが未インストールの場合、検索結果のインメモリキャッシュを無効化する
+    TTLCache = None
+
+# ログの書式化はレコードが出力される場合のみ行われるよう、メッセージの引数は %s で渡す
+logger = logging.getLogger(__name__)
 
 # --------------------------------------------------------------------------
 # --- 安全な計算ロジック (ast モジュールを使用) ---
@@ -23,12 +45,126 @@ ALLOWED_OPS = {
     ast.USub: operator.neg,  # 単項マイナス (例: -5)
 }
 
+def _is_number(value: Any) -> bool:
+    """定数ノードの値が数値 (int, float, complex) かどうかを判定する。boolは数値として扱わない。"""
+    return isinstance(value, (int, float, complex)) and not isinstance(value, bool)
+
+# 計算式に出現してよいASTノードの型 (演算子ノードを含む)
+_ALLOWED_NODES = frozenset({
+    ast.Constant, ast.UnaryOp, ast.BinOp,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub,
+})
+
+def validate(node) -> None:
+    """
+    ASTのすべてのノードが許可された構文・演算子のみで構成されているかを検査する。
+
+    検査は計算式ごとに一度だけ行い、以降の変換・評価では拒否のための型判定を行わない。
+
+    Args:
+        node: astモジュールによってパースされたノード。
+
+    Raises:
+        TypeError: 許可されていない構文や演算子が検出された場合。
+    """
+    for child in ast.walk(node):
+        node_type = type(child)
+        if node_type not in _ALLOWED_NODES:
+            if node_type is ast.Call or node_type is ast.Name:
+                # 関数呼び出しや変数参照を拒否
+                raise TypeError(f"関数呼び出しや変数参照は禁止されています: {node_type.__name__}")
+            if isinstance(child, ast.unaryop):
+                raise TypeError(f"許可されていない単項演算子: {node_type.__name__}")
+            if isinstance(child, ast.operator):
+                raise TypeError(f"許可されていない演算子: {node_type.__name__}")
+            # その他の危険なノードを拒否
+            raise TypeError(f"許可されていない構文: {node_type.__name__}")
+        if node_type is ast.Constant and not _is_number(child.value):
+            raise TypeError(f"許可されていない構文: {node_type.__name__}")
+
+# --- safe_eval_expression の後置記法 (逆ポーランド記法) への変換 ---
+# 以下の変換処理は validate() で検査済みのASTのみを対象とする。
+
+# 後置記法の命令種別 (演算子ごとに命令を分け、評価時は operator.add などの関数呼び出しを介さずに演算する)
+_PUSH = 0  # 数値をスタックに積む (payload: 数値)
+_ADD = 1   # スタックから2つ取り出して加算する
+_SUB = 2   # スタックから2つ取り出して減算する
+_MUL = 3   # スタックから2つ取り出して乗算する
+_DIV = 4   # スタックから2つ取り出して除算する
+_NEG = 5   # スタックから1つ取り出して符号を反転する
+
+# 演算子ノードの型 -> 命令種別 (ALLOWED_OPS と同じ演算子を扱う)
+_BINARY_OPCODES = {ast.Add: _ADD, ast.Sub: _SUB, ast.Mult: _MUL, ast.Div: _DIV}
+_UNARY_OPCODES = {ast.USub: _NEG}
+
+def _emit_constant(node, code, pending):
+    """数値定数を命令列に追加する。"""
+    code.append((_PUSH, node.value))
+
+def _emit_unary_op(node, code, pending):
+    """単項演算子 (例: マイナス) を命令列に追加し、オペランドを変換待ちに積む。"""
+    code.append((_UNARY_OPCODES[type(node.op)], None))
+    pending.append(node.operand)
+
+def _emit_bin_op(node, code, pending):
+    """二項演算子 (例: +, -, *, /) を命令列に追加し、左右のオペランドを変換待ちに積む。"""
+    code.append((_BINARY_OPCODES[type(node.op)], None))
+    # 右オペランドを先に取り出すよう左から積む (命令列は最後に反転する)
+    pending.append(node.left)
+    pending.append(node.right)
+
+# ノードの型 -> 変換関数 (isinstance の連鎖の代わりに、type(node) の辞書参照1回で分岐する)
+_EMIT_HANDLERS = {
+    ast.Constant: _emit_constant,
+    ast.UnaryOp: _emit_unary_op,
+    ast.BinOp: _emit_bin_op,
+}
+
+def _linearize(node) -> List[Tuple[int, Any]]:
+    """
+    検査済みのASTを後置記法の命令列 [(命令種別, payload), ...] に変換する。
+
+    明示的なスタックで走査するため、入れ子の深い計算式でも再帰呼び出しを行わない。
+    演算子を先に出力する前置順で走査し、最後に反転して後置順にする。
+    """
+    code = []
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        _EMIT_HANDLERS[type(node)](node, code, pending)
+    code.reverse()
+    return code
+
+def _execute(code: List[Tuple[int, Any]]):
+    """後置記法の命令列をスタックマシンで評価する。演算結果はスタックの先頭を直接置き換える。"""
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    for kind, payload in code:
+        if kind == _PUSH:
+            push(payload)
+        elif kind == _NEG:
+            stack[-1] = -stack[-1]
+        else:
+            right = pop()
+            if kind == _ADD:
+                stack[-1] = stack[-1] + right
+            elif kind == _SUB:
+                stack[-1] = stack[-1] - right
+            elif kind == _MUL:
+                stack[-1] = stack[-1] * right
+            else:
+                stack[-1] = stack[-1] / right
+    return stack[0]
+
 def safe_eval_expression(node):
     """
-    Pythonの抽象構文木(AST)を安全に評価する再帰関数。
+    Pythonの抽象構文木(AST)を安全に評価する。
     
     許可されていない関数呼び出しや変数参照を厳しく拒否することで、
     Pythonの組み込み関数 eval() の持つセキュリティリスクを回避する。
+    validate() で検査した後、ASTを後置記法の命令列に変換してスタックマシンで評価するため、
+    再帰呼び出しを行わない。
 
     Args:
         node: astモジュールによってパースされたノード。
@@ -39,29 +175,54 @@ def safe_eval_expression(node):
     Raises:
         TypeError: 許可されていない構文や演算子が検出された場合。
     """
-    if isinstance(node, ast.Num):
-        return node.n
-    elif isinstance(node, ast.UnaryOp):
-        # 単項演算子 (例: マイナス)
-        if type(node.op) not in ALLOWED_OPS:
-            raise TypeError(f"許可されていない単項演算子: {type(node.op).__name__}")
-        return ALLOWED_OPS[type(node.op)](safe_eval_expression(node.operand))
-    elif isinstance(node, ast.BinOp):
-        # 二項演算子 (例: +, -, *, /)
-        op = type(node.op)
-        if op not in ALLOWED_OPS:
-            raise TypeError(f"許可されていない演算子: {op.__name__}")
-        
-        left = safe_eval_expression(node.left)
-        right = safe_eval_expression(node.right)
-        
-        return ALLOWED_OPS[op](left, right)
-    elif isinstance(node, ast.Call) or isinstance(node, ast.Name):
-        # 関数呼び出しや変数参照を拒否
-        raise TypeError(f"関数呼び出しや変数参照は禁止されています: {type(node).__name__}")
-    else:
-        # その他の危険なノードを拒否
-        raise TypeError(f"許可されていない構文: {type(node).__name__}")
+    validate(node)
+    return _execute(_linearize(node))
+
+# 整数同士の演算結果が必ず整数になる二項演算の命令 -> 変換時の計算に使う演算関数
+# (除算は結果がfloatになり、ゼロ除算の例外もあるため含めない。単項の _NEG も畳み込む)
+_INT_FOLDABLE_BINARY = {_ADD: operator.add, _SUB: operator.sub, _MUL: operator.mul}
+
+def _is_int_push(instruction: Tuple[int, Any]) -> bool:
+    """命令が整数定数を積む PUSH 命令かどうかを判定する。"""
+    return instruction[0] == _PUSH and type(instruction[1]) is int
+
+def _fold_int_constants(code: List[Tuple[int, Any]]) -> List[Tuple[int, Any]]:
+    """
+    後置記法の命令列のうち、整数定数と _INT_FOLDABLE_BINARY・_NEG のみからなる部分式を変換時に計算し (部分評価)、
+    1つの PUSH 命令にまとめる。floatや除算を含む部分式は評価時に計算する。
+
+    命令列を先頭から1回走査するだけのため、入れ子の深い計算式でも再帰呼び出しを行わない。
+    """
+    folded = []
+    for kind, payload in code:
+        fold = _INT_FOLDABLE_BINARY.get(kind)
+        if fold is not None and len(folded) >= 2 and _is_int_push(folded[-1]) and _is_int_push(folded[-2]):
+            right = folded.pop()[1]
+            folded[-1] = (_PUSH, fold(folded[-1][1], right))
+        elif kind == _NEG and folded and _is_int_push(folded[-1]):
+            folded[-1] = (_PUSH, -folded[-1][1])
+        else:
+            folded.append((kind, payload))
+    return folded
+
+# 計算式から等号 (=) を削除するための変換テーブル (例: "5 - 3 = " -> "5 - 3 ")
+_STRIP_EQUALS_TABLE = str.maketrans('', '', '=')
+
+def _parse(expression: str) -> ast.AST:
+    """計算式をパースし、validate() で検査済みの式本体のASTノードを返す。"""
+    tree = ast.parse(expression, mode='eval').body
+    validate(tree)
+    return tree
+
+@lru_cache(maxsize=512)
+def _compile(expression: str) -> List[Tuple[int, Any]]:
+    """
+    計算式をパースして、整数のみの部分式を畳み込んだ後置記法の命令列に変換する。
+
+    エージェントのリトライなどで同じ計算式が繰り返し評価されるため、
+    パース・検査・変換の結果を計算式ごとにキャッシュする (構文エラーや検査エラーはキャッシュされない)。
+    """
+    return _fold_int_constants(_linearize(_parse(expression)))
 
 @tool
 def calculate(expression: str) -> str:
@@ -70,27 +231,292 @@ def calculate(expression: str) -> str:
     このツールは、Pythonのeval()を使わず、astモジュールによる安全なパーサーを使用している。
     """
     
-    logging.info(f"\n--- [LOG: Calculate Tool Called (Safe Mode)] ---")
-    logging.info(f"Input Expression: {expression}")
+    logger.info("\n--- [LOG: Calculate Tool Called (Safe Mode)] ---")
+    logger.info("Input Expression: %s", expression)
 
     try:
-        clean_expression = expression.replace('=', '').strip()
-        tree = ast.parse(clean_expression, mode='eval')
-        result = safe_eval_expression(tree.body)
+        clean_expression = expression.translate(_STRIP_EQUALS_TABLE).strip()
+        result = _execute(_compile(clean_expression))
         
-        logging.info(f"Result: {result}")
+        logger.info("Result: %s", result)
         return str(result)
     except TypeError as te:
-        logging.error(f"安全評価エラー: {te}")
+        logger.error("安全評価エラー: %s", te)
         return f"計算エラー: 許可されていない操作が含まれています。"
     except Exception as e:
-        logging.error(f"計算エラー: {e}", exc_info=False) 
+        logger.error("計算エラー: %s", e, exc_info=False) 
         return f"計算エラー: {e}"
 
 # --------------------------------------------------------------------------
 # --- Google Search ツール ---
 # --------------------------------------------------------------------------
 
+# SerpAPIのエンドポイント (google-search-results クライアントを介さず直接呼び出す)
+SERPAPI_ENDPOINT = "https://serpapi.com/search.json"
+# SerpAPIへのリクエストのタイムアウト (秒)
+SERPAPI_TIMEOUT = 10
+
+# SerpAPIへのリクエストのレート制限 (トークンバケット: 平均レート [回/秒] と瞬間的に許容する回数)
+SERPAPI_RATE_PER_SECOND = float(os.environ.get("SERPAPI_RATE_PER_SECOND", "5"))
+SERPAPI_RATE_BURST = 10
+# 一時的なエラー (429: レート超過、5xx: サーバーエラー、通信エラー) の最大リトライ回数と待ち時間 (秒)
+SERPAPI_MAX_RETRIES = 3
+SERPAPI_BACKOFF_BASE = 0.25
+SERPAPI_BACKOFF_MAX = 8.0
+_RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# SerpAPIキーとリクエストパラメータの共通部分 (呼び出しごとに環境変数を参照しないよう、インポート時に一度だけ生成する)
+# キーが未設定 (空文字を含む) の場合はNone。キーを変更した場合は refresh_serpapi_key() で反映する。
+_SERPAPI_KEY: Optional[str] = os.environ.get("SERPAPI_API_KEY") or None
+_BASE_PARAMS: Dict[str, Any] = {
+    "api_key": _SERPAPI_KEY,
+    "engine": "google",
+    "gl": "jp",
+    "hl": "ja",
+}
+_NO_KEY_MSG = "SerpAPIキーが設定されていません。検索を実行できません。"
+
+class SearchError(Exception):
+    """検索に失敗したことを表す例外 (APIキー未設定、通信エラー、SerpAPIのエラー応答)。
+
+    メッセージはツールとしての返却文字列であり、呼び出し側は結果をキャッシュせずにそのまま返せる。
+    """
+
+def refresh_serpapi_key(api_key: Optional[str] = None) -> None:
+    """
+    検索に使用するSerpAPIキーを更新する。
+
+    Args:
+        api_key: 新しいSerpAPIキー。省略した場合は環境変数 SERPAPI_API_KEY を再度読み込む。
+    """
+    global _SERPAPI_KEY
+    _SERPAPI_KEY = (api_key if api_key is not None else os.environ.get("SERPAPI_API_KEY")) or None
+    _BASE_PARAMS["api_key"] = _SERPAPI_KEY
+
+# 同期版で使い回すHTTPセッション
+# 呼び出しごとに接続を張り直さず、keep-aliveでTCP/TLS接続を再利用する (TLSハンドシェイクの省略)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+# 非同期版で同時に張るSerpAPIへの接続数の上限
+ASYNC_CONNECTION_LIMIT = 20
+
+# 非同期版で使い回すHTTPセッションと、それを生成したイベントループ (初回呼び出し時に生成する)
+_async_session = None
+_async_session_loop = None
+
+# 検索結果のインメモリキャッシュ ((クエリ, gl, hl) -> 検索結果の文字列)
+# 同じ会話の中で同じクエリが再発行された場合に、SerpAPIの待ち時間と利用枠の消費を省く
+SEARCH_MEMORY_CACHE_SIZE = 1024
+SEARCH_MEMORY_CACHE_TTL = int(os.environ.get("SEARCH_MEMORY_CACHE_TTL", "600"))
+_search_memory_cache = TTLCache(maxsize=SEARCH_MEMORY_CACHE_SIZE, ttl=SEARCH_MEMORY_CACHE_TTL) if TTLCache is not None else None
+# TTLCacheはスレッドセーフではないため、参照・登録はロックを取得して行う
+_search_memory_cache_lock = threading.Lock()
+
+def _search_cache_key(params: Dict[str, Any]) -> Tuple[str, str, str]:
+    """検索結果のインメモリキャッシュのキーを生成する。"""
+    return (params["q"], params["gl"], params["hl"])
+
+def _get_cached_search(cache_key: Tuple[str, str, str]) -> Any:
+    """キャッシュ済みの検索結果を返す。未登録・期限切れの場合はNoneを返す。"""
+    if _search_memory_cache is None:
+        return None
+    with _search_memory_cache_lock:
+        return _search_memory_cache.get(cache_key)
+
+def _store_search(cache_key: Tuple[str, str, str], search_result: str) -> None:
+    """検索結果をキャッシュに登録する。"""
+    if _search_memory_cache is None:
+        return
+    with _search_memory_cache_lock:
+        _search_memory_cache[cache_key] = search_result
+
+def _search_params(query: str) -> Dict[str, Any]:
+    """SerpAPIに渡すリクエストパラメータを生成する (共通部分にクエリを加えるのみ)。"""
+    return {**_BASE_PARAMS, "q": query}
+
+# オーガニック検索結果の各項目から (タイトル, スニペット, URL) を一度に取り出す
+_ORGANIC_FIELDS = operator.itemgetter('title', 'snippet', 'link')
+
+def _iter_organic_results(organic_results: List[Dict[str, Any]]):
+    """オーガニック検索結果のうち、タイトルとURLを持つものを整形して順に返す。"""
+    for result in organic_results:
+        try:
+            # 3つのキーがすべて揃っている一般的なケースは、C実装の itemgetter で一度に取り出す
+            title, snippet, link = _ORGANIC_FIELDS(result)
+        except KeyError:
+            # スニペットなどが欠けている場合も、タイトルとURLがあれば使用する
+            title, snippet, link = result.get('title'), result.get('snippet'), result.get('link')
+        if title and link:
+            yield f"タイトル: {title} | スニペット: {snippet} | URL: {link}"
+
+def _format_results(raw_results: Dict[str, Any]) -> str:
+    """
+    SerpAPIの応答から上位3件の検索結果（アンサーボックス、スニペット、URL）を結合した文字列を生成する。
+    """
+    # 知識グラフ、アンサーボックスの順に優先
+    head = []
+    if knowledge_graph := raw_results.get('knowledge_graph', {}).get('snippet'):
+        head.append(f"知識グラフ: {knowledge_graph}")
+    if answer_box := raw_results.get('answer_box', {}).get('snippet'):
+        head.append(f"アンサーボックス: {answer_box}")
+    
+    # オーガニック検索結果 (ジェネレータのため、残りの枠に使われる分だけ文字列を生成する)
+    tail = _iter_organic_results(raw_results.get('organic_results', []))
+    
+    result = " ||| ".join(islice(chain(head, tail), 3))
+    if result:
+        logger.info("--- [LOG: Google Search Tool Return] ---")
+        return result
+        
+    return "検索結果が見つかりませんでした。"
+
+# --- SerpAPIのレート制御 ---
+
+class _TokenBucket:
+    """
+    スレッドセーフなトークンバケット。リクエストごとにトークンを1つ消費し、不足する場合は補充まで待機する。
+
+    トークンは残高を負にして予約するため、待機中の呼び出しも到着順に一定間隔で実行される。
+    """
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """トークンを1つ予約し、使用可能になるまでの待ち時間 (秒) を返す。"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+
+    def acquire(self) -> None:
+        """トークンを1つ取得する。不足する場合は現在のスレッドで待機する。"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """acquire の非同期版。待機中もイベントループを止めない。"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+# 同期版・非同期版で共有するレート制限 (キャッシュにヒットした検索はトークンを消費しない)
+_RATE_LIMITER = _TokenBucket(SERPAPI_RATE_PER_SECOND, SERPAPI_RATE_BURST)
+
+def _backoff_delay(attempt: int) -> float:
+    """リトライまでの待ち時間 (指数バックオフ + ジッター) を返す。"""
+    return min(2 ** attempt * SERPAPI_BACKOFF_BASE, SERPAPI_BACKOFF_MAX) + random.uniform(0, SERPAPI_BACKOFF_BASE)
+
+def _fetch_results(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    レート制限に従ってSerpAPIを呼び出し、応答JSONを返す。
+
+    429 (レート超過)、5xx、通信エラーの場合は指数バックオフで最大 SERPAPI_MAX_RETRIES 回リトライする。
+    SerpAPIが応答JSONの "error" で返すエラー (検索結果なし、APIキー不正など) はリトライしない。
+    """
+    for attempt in range(SERPAPI_MAX_RETRIES + 1):
+        _RATE_LIMITER.acquire()
+        try:
+            with _SESSION.get(SERPAPI_ENDPOINT, params=params, timeout=SERPAPI_TIMEOUT) as response:
+                if response.status_code not in _RETRY_STATUS_CODES or attempt == SERPAPI_MAX_RETRIES:
+                    return response.json()
+                logger.warning("SerpAPIが一時的なエラーを返しました (HTTP %s)。リトライします (%s回目)。", response.status_code, attempt + 1)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == SERPAPI_MAX_RETRIES:
+                raise
+            logger.warning("SerpAPIとの通信に失敗しました: %s。リトライします (%s回目)。", e, attempt + 1)
+        time.sleep(_backoff_delay(attempt))
+
+def _prepare_search(query: str, use_cache: bool) -> Tuple[Dict[str, Any], Tuple[str, str, str], Optional[str]]:
+    """
+    検索の前処理 (APIキーの確認、リクエストパラメータの生成、インメモリキャッシュの参照)。同期版・非同期版で共有する。
+
+    Returns:
+        (リクエストパラメータ, キャッシュのキー, キャッシュにヒットした場合は検索結果、それ以外はNone)
+
+    Raises:
+        SearchError: APIキーが設定されていない場合。
+    """
+    if _SERPAPI_KEY is None:
+         logger.warning("SerpAPIキーが設定されていません。")
+         raise SearchError(_NO_KEY_MSG)
+
+    params = _search_params(query)
+    cache_key = _search_cache_key(params)
+    if use_cache:
+        search_result = _get_cached_search(cache_key)
+        if search_result is not None:
+            logger.info("--- [LOG: SerpAPI Memory Cache Hit] ---")
+            return params, cache_key, search_result
+    
+    logger.info("\n--- [LOG: SerpAPI Request Details] ---")
+    if logger.isEnabledFor(logging.DEBUG):
+        # APIキーを除いたリクエストパラメータ (ログ出力しない場合は辞書を生成しない)
+        logger.debug("Request Params: %s", {key: value for key, value in params.items() if key != "api_key"})
+    return params, cache_key, None
+
+def _search_failure(e: Exception) -> SearchError:
+    """SerpAPIの呼び出しや応答の整形で発生した例外をログに記録し、SearchError に変換する。"""
+    logger.error("SerpAPI通信中に予期せぬエラーが発生しました: %s", e, exc_info=True)
+    return SearchError(f"SerpAPI通信中に予期せぬエラーが発生しました: {e}")
+
+def _finish_search(raw_results: Dict[str, Any], cache_key: Tuple[str, str, str], use_cache: bool) -> str:
+    """
+    検索の後処理 (応答の整形、エラー応答の判定、インメモリキャッシュへの登録)。同期版・非同期版で共有する。
+
+    Raises:
+        SearchError: 応答の整形に失敗した場合、またはSerpAPIがエラーを返した場合 (APIキー不正、利用枠超過など)。
+    """
+    try:
+        search_result = _format_results(raw_results)
+    except Exception as e:
+        raise _search_failure(e) from e
+    
+    # SerpAPIがエラーを返した場合は失敗として扱い、キャッシュしない
+    if "error" in raw_results:
+        raise SearchError(search_result)
+    if use_cache:
+        _store_search(cache_key, search_result)
+    return search_result
+
+def search_google(query: str, use_cache: bool = True) -> str:
+    """
+    google_search ツールの本体。エージェントからはツールを介さず、キャッシュの利用を指定して呼び出せる。
+
+    Args:
+        query: Google検索に渡すクエリ文字列。
+        use_cache: Falseの場合、インメモリキャッシュを参照・更新せずに毎回SerpAPIを呼び出す
+            (為替レートや「最新」を含むクエリなど、結果の鮮度が重要な場合)。
+
+    Returns:
+        上位3件の検索結果（アンサーボックス、スニペット、URL）を結合した文字列。
+
+    Raises:
+        SearchError: APIキー未設定、通信エラー、またはSerpAPIがエラーを返した場合 (APIキー不正、利用枠超過など)。
+    """
+    params, cache_key, search_result = _prepare_search(query, use_cache)
+    if search_result is not None:
+        return search_result
+    
+    try:
+        raw_results = _fetch_results(params)
+    except Exception as e:
+        raise _search_failure(e) from e
+    return _finish_search(raw_results, cache_key, use_cache)
+
+def _search_or_message(query: str, use_cache: bool = True) -> str:
+    """search_google を呼び出し、失敗した場合はその理由の文字列を返す。"""
+    try:
+        return search_google(query, use_cache)
+    except SearchError as e:
+        return str(e)
+
 @tool
 def google_search(query: str) -> str:
     """
@@ -102,49 +528,95 @@ def google_search(query: str) -> str:
     Returns:
         上位3件の検索結果（アンサーボックス、スニペット、URL）を結合した文字列。
     """
-    api_key = os.environ.get("SERPAPI_API_KEY")
-    
-    if not api_key:
-         logging.warning("SerpAPIキーが設定されていません。")
-         return "SerpAPIキーが設定されていません。検索を実行できません。"
-
-    params: Dict[str, Any] = {
-        "api_key": api_key,
-        "engine": "google",
-        "q": query,
-        "gl": "jp",
-        "hl": "ja",
-    }
+    return _search_or_message(query)
+
+# --------------------------------------------------------------------------
+# --- Google Search (非同期・一括実行) ---
+# --------------------------------------------------------------------------
+
+def _get_async_session() -> "aiohttp.ClientSession":
+    """実行中のイベントループに紐づくHTTPセッションを返す。未生成または別のループのものであれば生成し直す。
+
+    aiohttpのセッションは生成したイベントループでしか使用できないため、
+    asyncio.run() の呼び出しごとにループが変わる場合は新しいセッションを生成する。
+    """
+    global _async_session, _async_session_loop
+    loop = asyncio.get_running_loop()
+    if _async_session is None or _async_session.closed or _async_session_loop is not loop:
+        _async_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_CONNECTION_LIMIT))
+        _async_session_loop = loop
+    return _async_session
+
+async def close_async_session() -> None:
+    """非同期版で使用したHTTPセッションを閉じる。イベントループを終了する前に呼び出す。"""
+    global _async_session, _async_session_loop
+    if _async_session is not None and not _async_session.closed:
+        await _async_session.close()
+    _async_session = None
+    _async_session_loop = None
+
+async def _fetch_results_async(params: Dict[str, Any]) -> Dict[str, Any]:
+    """_fetch_results の非同期版。レート制限とリトライの待機中もイベントループを止めない。"""
+    session = _get_async_session()
+    for attempt in range(SERPAPI_MAX_RETRIES + 1):
+        await _RATE_LIMITER.acquire_async()
+        try:
+            async with session.get(SERPAPI_ENDPOINT, params=params, timeout=aiohttp.ClientTimeout(total=SERPAPI_TIMEOUT)) as response:
+                if response.status not in _RETRY_STATUS_CODES or attempt == SERPAPI_MAX_RETRIES:
+                    return await response.json()
+                logger.warning("SerpAPIが一時的なエラーを返しました (HTTP %s)。リトライします (%s回目)。", response.status, attempt + 1)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == SERPAPI_MAX_RETRIES:
+                raise
+            logger.warning("SerpAPIとの通信に失敗しました: %s。リトライします (%s回目)。", e, attempt + 1)
+        await asyncio.sleep(_backoff_delay(attempt))
+
+async def search_google_async(query: str, use_cache: bool = True) -> str:
+    """
+    search_google の非同期版。SerpAPIのエンドポイントをaiohttpで直接呼び出す。
+
+    aiohttpがインストールされていない場合は、search_google をスレッドで実行する。
     
-    logging.info("\n--- [LOG: SerpAPI Request Details] ---")
+    Args:
+        query: Google検索に渡すクエリ文字列。
+        use_cache: Falseの場合、インメモリキャッシュを参照・更新せずに毎回SerpAPIを呼び出す。
+        
+    Returns:
+        上位3件の検索結果（アンサーボックス、スニペット、URL）を結合した文字列。
 
+    Raises:
+        SearchError: search_google と同じ。
+    """
+    if aiohttp is None:
+        return await asyncio.to_thread(search_google, query, use_cache)
+    
+    params, cache_key, search_result = _prepare_search(query, use_cache)
+    if search_result is not None:
+        return search_result
+    
     try:
-        search = GoogleSearch(params)
-        raw_results = search.get_dict()
-        
-        combined_results = []
-        
-        # アンサーボックス、知識グラフを優先
-        if raw_results.get('answer_box', {}).get('snippet'):
-            combined_results.insert(0, f"アンサーボックス: {raw_results['answer_box']['snippet']}")
-        if raw_results.get('knowledge_graph', {}).get('snippet'):
-            combined_results.insert(0, f"知識グラフ: {raw_results['knowledge_graph']['snippet']}")
-        
-        # オーガニック検索結果
-        for result in raw_results.get('organic_results', []):
-            title = result.get('title')
-            snippet = result.get('snippet')
-            link = result.get('link')
-            if title and link:
-                combined_results.append(f"タイトル: {title} | スニペット: {snippet} | URL: {link}")
-        
-        if combined_results:
-            result = " ||| ".join(combined_results[:3])
-            logging.info(f"--- [LOG: Google Search Tool Return] ---")
-            return result
-            
-        return "検索結果が見つかりませんでした。"
-        
+        raw_results = await _fetch_results_async(params)
     except Exception as e:
-        logging.error(f"SerpAPI通信中に予期せぬエラーが発生しました: {e}", exc_info=True)
-        return f"SerpAPI通信中に予期せぬエラーが発生しました: {e}"
\ No newline at end of file
+        raise _search_failure(e) from e
+    return _finish_search(raw_results, cache_key, use_cache)
+
+async def google_search_async(query: str, use_cache: bool = True) -> str:
+    """google_search ツールの非同期版。失敗した場合はツールと同様に、その理由の文字列を返す。"""
+    try:
+        return await search_google_async(query, use_cache)
+    except SearchError as e:
+        return str(e)
+
+async def google_search_batch(queries: List[str]) -> List[str]:
+    """
+    複数のクエリを並行して検索し、クエリと同じ順序で結果を返す。
+
+    N件のクエリの待ち時間は、逐次実行のN往復分からほぼ1往復分に短縮される。
+
+    Args:
+        queries: Google検索に渡すクエリ文字列のリスト。
+
+    Returns:
+        各クエリの検索結果の文字列のリスト。
+    """
+    return list(await asyncio.gather(*(google_search_async(query) for query in queries)))